@@ -12,10 +12,34 @@ Generate an XML schema from a json schema defined for CPERs
 """
 
 #imports
+import functools
+import hashlib
 import json
+import logging
 import os
-import xml.dom.minidom 
+import re
+import sys
 import argparse
+from collections import deque
+
+# Prefer orjson for loading/dumping schemas, it is considerably
+# faster than the stdlib json module on large schemas
+try:
+    import orjson
+    _loads = orjson.loads
+    def _dumps(obj):
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+except ImportError:
+    _loads = json.loads
+    def _dumps(obj):
+        return json.dumps(obj, indent=1)
+
+# lxml (libxml2) parses generated XML much faster than a Python
+# line scan, fall back to the scan when it is not installed
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
 
 HEADER = '''<?xml version="1.0" encoding="UTF-8"?>
 <edmx:Edmx xmlns:edmx="http://docs.oasis-open.org/odata/ns/edmx" Version="4.0">
@@ -34,8 +58,53 @@ FOOTER = '''
   </edmx:DataServices>
 </edmx:Edmx>'''
 
+_logger = logging.getLogger(__name__)
+
+# Maximum nesting searched for the start property
+MAX_DEPTH = 64
+
+# Closing tag shared by every EntityType. The other XML fragments stay as
+# f-string literals, which build the output in a single allocation and
+# benchmark faster than joining module-level tokens.
+_ENT_END = '      </EntityType>\n'
+
 SKIP_KEYS = ["ArmProcessorArmProcessorerrorInfoErrorInformation"]
 
+# json schema type -> XML (EDM) type
+_TYPEMAP = {sys.intern(k): v for k, v in {'integer':"Edm.Int64", 'uint64':"Edm.Int64", 'string':"Edm.String", 'boolean':"Edm.Boolean"}.items()}
+
+_ENTITY_RE = re.compile(r'EntityType Name="([^"]+)"')
+
+@functools.lru_cache(maxsize=4096)
+def _format_propname(name):
+    """
+    Change how property names are displayed. Memoized, as the same
+    $id is formatted repeatedly during a walk.
+    Args:
+        name (string): Property name
+    Returns:
+        result (string): Formatted name
+    """
+    names_l = name.split('-')
+    # For CPER schemas, name is of the format 
+    # cper-json-error-status or cper-json-firmware-section
+    return ''.join(n.title() for n in names_l[2:] if n != 'section')
+
+def _drain(gen, out):
+    """
+    Exhaust a generator into a list
+    Args:
+        gen (generator): Generator of XML chunks
+        out (list): List the chunks are appended to
+    Returns:
+        result: Return value of gen
+    """
+    while True:
+        try:
+            out.append(next(gen))
+        except StopIteration as e:
+            return e.value
+
 class SchemaGenerator:
     
     """ 
@@ -49,9 +118,18 @@ class SchemaGenerator:
             base_schema (string): Path to root json schema file
         """
         self.ref_paths={}
+        # Fully expanded schemas keyed by ref filename, so each referenced
+        # file is read and expanded once
+        self._expanded_cache = {}
         self.rootpath = rootpath
-        self.base_schema=json.load(open(os.path.join(rootpath, base_schema)))
         self.map_schemas(rootpath)
+        # base_schema is a path relative to rootpath, otherwise look it up
+        # by filename among the scanned schemas
+        base_path = os.path.join(rootpath, base_schema)
+        if not os.path.isfile(base_path) and base_schema in self.ref_paths:
+            base_path = self.ref_paths[base_schema]
+        with open(base_path, 'rb') as schema_file:
+            self.base_schema = _loads(schema_file.read())
         
     def map_schemas(self, schema_dir):
         """
@@ -59,46 +137,85 @@ class SchemaGenerator:
         Args:
             schema_dir (string): Path to root directory containing all json schema files
         """
-        for root, _, files in os.walk(schema_dir):
-            for filename in files:
-                if filename.endswith(".json"):
-                    schema_path = os.path.join(root, filename)
-                    self.ref_paths[filename]=schema_path
+        def _walk(d):
+            # Like os.walk, a directory's files come before its subdirectories
+            subdirs = []
+            with os.scandir(d) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.name.endswith(".json") and entry.is_file():
+                        yield entry.name, entry.path
+            for subdir in subdirs:
+                yield from _walk(subdir)
+
+        for filename, schema_path in _walk(schema_dir):
+            if filename in self.ref_paths:
+                # Refs are resolved by filename only, so the last file found wins
+                print("Warning duplicate schema filename: %s (%s, %s)"
+                      % (filename, self.ref_paths[filename], schema_path))
+            self.ref_paths[filename]=schema_path
 
     def refresolve(self,ref):
         if ref not in self.ref_paths:
             print("Error no ref path named: ", ref) 
             return
-        with open(self.ref_paths[ref], 'r') as schema_file:
-            return json.load(schema_file)
+        with open(self.ref_paths[ref], 'rb') as schema_file:
+            return _loads(schema_file.read())
+
 
+    def expand_ref(self, ref):
+        """
+        Fully expand the json file named by a $ref, resolving any nested refs
+        Args:
+            ref (string): Value of the $ref property
+        Returns:
+            result (dict): The expanded json schema, shared by every occurrence of the ref
+        """
+        # Keep only the filename, dropping any '#' fragment
+        ref = ref.partition('#')[0].replace('\\', '/').rpartition('/')[2]
+        if ref not in self._expanded_cache:
+            # The freshly loaded schema is expanded in place
+            replaced_ref = self.replace_refs(self.refresolve(ref))
+            replaced_ref.pop("$schema", None)
+            self._expanded_cache[ref] = replaced_ref
+        # Occurrences share the expanded schema rather than getting a copy each,
+        # copying costs more than re-parsing the file
+        return self._expanded_cache[ref]
 
     def replace_refs(self,schema):
         """
-        Replace all references of $ref with actual json file contents
+        Replace all references of $ref with actual json file contents.
+        The schema is walked iteratively and modified in place. Every occurrence
+        of the same ref is replaced by the same object, so modifying one of them
+        modifies all of them.
         Args:
             schema (string): Original json schema file as a string
         Returns:
             result (string): transformed json schema file
         """
-        if isinstance(schema, dict):
-            if '$ref' in schema:
-                print(schema)
-                ref = os.path.basename(schema['$ref'])
-                resolved_schema = self.refresolve(ref)
-                replaced_ref = self.replace_refs(resolved_schema)
-                replaced_ref.pop("$schema", None)
-                return  replaced_ref
-            else:
-                for key, value in schema.items():
-                    schema[key] = self.replace_refs(value)
-        elif isinstance(schema, list):
-            schema = [self.replace_refs(item) for item in schema]            
-            
+        stack = deque([(None, None, schema)])
+        while stack:
+            parent, key, node = stack.pop()
+            if isinstance(node, dict):
+                if '$ref' in node:
+                    resolved_schema = self.expand_ref(node['$ref'])
+                    if parent is None:
+                        schema = resolved_schema
+                    else:
+                        parent[key] = resolved_schema
+                else:
+                    # Leaves can't contain refs, only queue containers
+                    stack.extend((node, k, v) for k, v in node.items()
+                                 if isinstance(v, (dict, list)))
+            elif isinstance(node, list):
+                stack.extend((node, i, item) for i, item in enumerate(node)
+                             if isinstance(item, (dict, list)))
+
         return schema
 
     # Modify named properties in a json schema
-    def modify_schema(self, schema, keytomod):
+    def modify_schema(self, schema, keytomod, _seen=None):
         """
         Replace all references of $ref with actual json file contents
         Args:
@@ -107,24 +224,33 @@ class SchemaGenerator:
         Returns:
             result (string): json schema file with modified property
         """
+        # Expanded refs are shared between occurrences, transform each only once
+        if _seen is None:
+            _seen = set()
+        if id(schema) in _seen:
+            return schema
+        _seen.add(id(schema))
+
         if isinstance(schema, dict):
             for key, value in schema.items():
                 if key == keytomod:
                     propname = schema[key]
                     # Define your own transform in place of capitalize()
                     schema[key] = self.capitalize(propname)
-                else:
-                    schema[key] = self.modify_schema(value)
+                elif isinstance(value, (dict, list)):
+                    schema[key] = self.modify_schema(value, keytomod, _seen)
             
             return schema
             
         elif isinstance(schema, list):
-            schema = [self.modify_schema(item) for item in schema]            
+            for i, item in enumerate(schema):
+                if isinstance(item, (dict, list)):
+                    schema[i] = self.modify_schema(item, keytomod, _seen)
             
         return schema
     
     def capitalize(self, propname):
-        return propname[0].upper() + propname[1:]
+        return propname[:1].upper() + propname[1:]
 
 
 class JsontoXml:
@@ -138,13 +264,14 @@ class JsontoXml:
     def __init__(self, debug=False, parent_basetype=None, required=False, start_property = 'sections'):
         """
         Args:
-            debug (bool): Enables verbose printing of schema and properties in each iteration. Default is False.
+            debug (bool): Enables verbose logging of schema and properties in each iteration, at DEBUG level on
+                          this module's logger. Configure logging (e.g. logging.basicConfig(level=logging.DEBUG))
+                          to see it; the CLI does this for -v. Default is False.
             parent_basetype (string): Base type of XML schema, which is referred to by all child properties
             required (bool): Populate only "required" properties of the json schema in the XML. Default is False.
             start_property (string): Change root element of the json schema, so XML will only be a subset. This should
                                     be defined in the "properties" field
         """
-        self.typemap = {'integer':"Edm.Int64", 'uint64':"Edm.Int64", 'string':"Edm.String", 'boolean':"Edm.Boolean"}
         self.debug = debug
         # add a parent_basetype to instruct code to always
         # use this as the inferred base data type. Else,
@@ -152,7 +279,11 @@ class JsontoXml:
         self.parent_basetype = parent_basetype
         self.required = required
         self.start_property = start_property
-        self.error_status_present = False
+        # EntityType name -> set of digests of the XML variants emitted by the current walk
+        self._emitted = {}
+        # ($id, basetype, baseid, prevproperty) -> $id based name, for the
+        # subschemas already walked by the current walk
+        self._walked = {}
     
     def jsonschema_to_xml(self, schema, basetype, baseid, prevproperty=""):
         """
@@ -162,80 +293,105 @@ class JsontoXml:
             basetype (string): Parent data type of property. Use same as parent_basetype if the entire json schema is being used. 
             baseid (string): Reference to closest ancestor $id property. This is used to provide unique namespaces to repeatable properties. 
         Returns:
+            result (tuple): XML schema for CPER output, and the $id based name of the schema if any
+        """
+        self._emitted = {}
+        self._walked = {}
+        chunks = []
+        ret_id = _drain(self.iter_xml(schema, basetype, baseid, prevproperty), chunks)
+        return (''.join(chunks), ret_id)
+
+    def iter_xml(self, schema, basetype, baseid, prevproperty=""):
+        """
+        Generator version of jsonschema_to_xml, yields the XML in chunks
+        Args:
+            schema (string): Original json schema file as a string
+            basetype (string): Parent data type of property. Use same as parent_basetype if the entire json schema is being used. 
+            baseid (string): Reference to closest ancestor $id property. This is used to provide unique namespaces to repeatable properties. 
+        Yields:
             result (string): XML schema for CPER output
+        Returns:
+            result (string): $id based name of the schema if any
         """
         if self.debug:
-            print("\n\n\n\n")
-            print(json.dumps(schema, indent=1))
+            _logger.debug('\n\n\n\n%s', json.dumps(schema, indent=1))
             
         if isinstance(schema, dict):
             req = schema.get('required')
             if req:
                 assert isinstance(req, list), "request field is not a list"
-
-                if (baseid + basetype).lower() == "errorstatuserrortype":
-                    if not self.error_status_present:
-                        self.error_status_present = True
-                    else:
-                        return ("", "")
+                req_set = frozenset(req)
 
                 props = schema.get('properties')
                 if not props:
-                    print("'Required' field was found. 'Properties' field not found for: \n", schema)
-                    return(1)
+                    raise ValueError("'Required' field was found. 'Properties' field not found for: \n%s" % schema)
                     
                 id = schema.get('$id')
+                # A subschema reached again with the same arguments renders the
+                # same entities, all of which are already emitted, so only the
+                # $id based name is needed
+                if id:
+                    walk_key = (id, basetype, baseid, prevproperty)
+                    if walk_key in self._walked:
+                        return self._walked[walk_key]
                 if (id and "namevaluepair" not in id):
-                    basetype = self.format_propname(id)
-                start,end = self.encode_xml(baseid, basetype, 'base')
-                property_xml = start
+                    basetype = _format_propname(id)
+                entity_name = baseid + basetype[0].upper() + basetype[1:]
+                start,end = self.encode_xml_base(baseid, basetype)
+                buf = [start]
 
                 # We need a way to return baseid to the parent property when the baseids
                 # are encapsulated in a list, like in oneOf[]
                 ret_id = None
                 if id:
-                    baseid = self.format_propname(id)
+                    baseid = _format_propname(id)
                     ret_id = baseid
                     self.id = id
 
                 if ('validationbits' in basetype.lower()):
                     baseid+=prevproperty
                     
-                xml_ret = ""
+                # Child entities are streamed out as they are generated,
+                # this entity follows once all of its properties are known
                 for prop, propval in props.items():
-                    if self.required and (prop not in req):
+                    if self.required and (prop not in req_set):
                         continue
                     if self.debug:
-                        print(prop)
+                        _logger.debug('%s', prop)
                     # Get each property
                     if (prop.lower() == 'validationbits'):
                         baseid+=basetype
                     subschema = propval
-                    property_xml += self.encode_xml(baseid, prop, 'property', type=subschema['type'], basetype=basetype)
-                    xml_ret += self.jsonschema_to_xml(propval, prop, baseid, prevproperty=basetype)[0]
+                    buf.append(self.encode_xml_property(baseid, prop, subschema['type'], basetype))
+                    # Leaf properties (string, integer, ...) produce no entities
+                    # of their own, so only descend into ones that can
+                    if 'required' in subschema or 'oneOf' in subschema or 'items' in subschema:
+                        yield from self.iter_xml(propval, prop, baseid, prevproperty=basetype)
                     
-                property_xml += end
-                xml_ret += property_xml
+                buf.append(end)
+                entity_xml = ''.join(buf)
                 if self.debug:
-                    print(xml_ret)
-                return (xml_ret,ret_id)
+                    _logger.debug('%s', entity_xml)
+                if self.is_new_entity(entity_name, entity_xml):
+                    yield entity_xml
+                if id:
+                    self._walked[walk_key] = ret_id
+                return ret_id
 
 
             else: 
                 if schema.get('oneOf'):
-                    return self.jsonschema_to_xml(schema['oneOf'], basetype, baseid, prevproperty)
+                    return (yield from self.iter_xml(schema['oneOf'], basetype, baseid, prevproperty))
                 elif schema.get('items'):
-                    return self.jsonschema_to_xml(schema['items'], basetype, baseid, prevproperty)
+                    return (yield from self.iter_xml(schema['items'], basetype, baseid, prevproperty))
                 else:
-                    return ("", None)
+                    return None
             
         elif isinstance(schema, list):
-            property_xml = ""
             properties_oneof = []
             for i, item in enumerate(schema):
                 # print("in oneof, basetype:", basetype, json.dumps(item, indent=1))
-                xml, ret_id = self.jsonschema_to_xml(item, basetype, baseid, "")
-                property_xml += xml
+                ret_id = yield from self.iter_xml(item, basetype, baseid, "")
                 if ret_id:
                     properties_oneof.append(ret_id)
                 else:
@@ -244,13 +400,37 @@ class JsontoXml:
 
             #This works only if $id is defined for every oneof[]
             if len(properties_oneof):
-                xml,end = self.encode_xml(baseid, basetype, 'base')
+                start,end = self.encode_xml_base(baseid, basetype)
+                buf = [start]
                 for prop in properties_oneof:
-                    print(baseid, prop)
-                    xml += self.encode_xml(baseid, prop, 'property', 'object', basetype=basetype)
+                    _logger.debug('%s %s', baseid, prop)
+                    buf.append(self.encode_xml_property(baseid, prop, 'object', basetype))
                 
-                xml += end
-            return (property_xml + xml, None)
+                buf.append(end)
+                entity_xml = ''.join(buf)
+                if self.is_new_entity(baseid + basetype[0].upper() + basetype[1:], entity_xml):
+                    yield entity_xml
+            return None
+
+    def is_new_entity(self, name, entity_xml):
+        """
+        Check whether an EntityType still has to be emitted. The same entity can be
+        reached through several oneOf branches; an exact repeat is dropped, while a
+        repeat with different properties is still emitted and reported.
+        Args:
+            name (string): EntityType name
+            entity_xml (string): XML of the EntityType
+        Returns:
+            result (bool): True if the entity should be emitted
+        """
+        digest = hashlib.sha1(entity_xml.encode()).digest()
+        emitted = self._emitted.setdefault(name, set())
+        if digest in emitted:
+            return False
+        if emitted:
+            _logger.warning("EntityType %s emitted again with different properties", name)
+        emitted.add(digest)
+        return True
     
 
     def schema_parser(self, schema, basetype="Nvidia", baseid=""):
@@ -264,32 +444,59 @@ class JsontoXml:
             baseid (string): Reference to closest ancestor $id property. This is used to provide unique namespaces to repeatable properties.
                              User should leave this empty.  
         Returns:
+            result (string): XML schema for CPER output, None if start_property was not found
+        """
+        try:
+            base_schema = self.find_start_property(schema)
+        except ValueError as e:
+            print("ERROR", e)
+            return None
+        parts = [HEADER, self.jsonschema_to_xml(base_schema, basetype=basetype, baseid=baseid)[0], FOOTER]
+
+        return ''.join(parts)
+
+    def iter_schema(self, schema, basetype="Nvidia", baseid=""):
+        """
+        Streaming counterpart of schema_parser. Yields the XML for the schema in
+        chunks, without HEADER and FOOTER, so it can be written out incrementally.
+        Args:
+            schema (string): Original json schema file as a string
+            basetype (string): Parent data type of property.
+            baseid (string): Reference to closest ancestor $id property. User should leave this empty.
+        Yields:
             result (string): XML schema for CPER output
         """
-        xml_out = HEADER
+        base_schema = self.find_start_property(schema)
+        self._emitted = {}
+        self._walked = {}
+        yield from self.iter_xml(base_schema, basetype, baseid)
+
+    def find_start_property(self, schema):
+        """
+        Find the subschema for start_property
+        Args:
+            schema (string): Original json schema file as a string
+        Returns:
+            result (dict): Schema of start_property
+        Raises:
+            ValueError: start_property was not found
+        """
         start_property = self.start_property
         # base_schema = { "required": ['Nvidia'], 'properties' : { 'Nvidia': {} } }
-        while not schema.get(start_property):
+        for _ in range(MAX_DEPTH):
+            if start_property in schema:
+                return schema[start_property]
+            if start_property in schema.get('properties', ()):
+                return schema['properties'][start_property]
             if schema.get('oneOf'):
                 schema = schema['oneOf'][0]
                 continue
-            elif schema.get('required'):
-                if start_property in schema['required']:
-                    schema = schema['properties']
-                    continue
-            else:
-                print("ERROR could not find ", start_property)
-                return
-        schema = schema[start_property]
-        base_schema = schema
-        xml_out += self.jsonschema_to_xml(base_schema, basetype=basetype, baseid=baseid)[0]
-        xml_out += FOOTER
-
-        return xml_out
+            break
+        raise ValueError("could not find %s" % start_property)
 
     def get_schema_file(self,filename):
-        with open(filename, 'r') as schema_file: 
-            schema = json.load(schema_file)
+        with open(filename, 'rb') as schema_file:
+            schema = _loads(schema_file.read())
         return schema
 
     def format_propname(self, name):
@@ -300,17 +507,7 @@ class JsontoXml:
         Returns:
             result (string): Formatted name
         """
-        names_l = name.split('-')
-        # For CPER schemas, name is of the format 
-        # cper-json-error-status or cper-json-firmware-section
-        ret=""
-        for n in names_l[2:]:
-            if n =='section':
-                continue
-            ret+=n.title()
-        return ret
-            
-
+        return _format_propname(name)
 
     def encode_xml(self, baseid, val, ele, type=None, basetype= None):
         """
@@ -326,38 +523,93 @@ class JsontoXml:
         Returns:
             result (string): XML schema for CPER output
         """
-        # val = self.format_propname(val)
-        entity_name = baseid+ val[0].upper() + val[1:]
-        prop_name = val[0].upper() + val[1:]
-        prop_type = baseid + val[0].upper() + val[1:]
         if ele == "base":
-            # print("in encode_xml: args baseid: %s , val: %s, basetype: %s"%(baseid, val, basetype))
-            return "\n      <EntityType Name=\"" + entity_name +"\">\n", "      </EntityType>\n"
+            return self.encode_xml_base(baseid, val)
         elif ele == "property":
-            if self.parent_basetype:
-                basetype = self.parent_basetype
-            else:
-                basetype = basetype[0].upper() + basetype[1:]
-            if (type == 'object' or type == 'array'):
-                return ("          <Property Name=\"" + prop_name +"\" Type=\"" + basetype + "."  + prop_type + "\"></Property>\n")  
-            else:
-                return ("          <Property Name=\"" + prop_name +"\" Type=\"" + self.typemap[type] + "\"></Property>\n")
+            return self.encode_xml_property(baseid, val, type, basetype)
         else:
             print("wrong value for XML element: ", ele)
 
+    def encode_xml_base(self, baseid, val):
+        """
+        Format the XML EntityType for a property
+        Args:
+            baseid (string): Reference to closest ancestor $id property.
+            val (string): Entity name
+        Returns:
+            result (tuple): Opening and closing EntityType tags
+        """
+        entity_name = baseid + val[0].upper() + val[1:]
+        return f'\n      <EntityType Name="{entity_name}">\n', _ENT_END
+
+    def encode_xml_property(self, baseid, val, type, basetype):
+        """
+        Format an XML Property of an EntityType
+        Args:
+            baseid (string): Reference to closest ancestor $id property.
+            val (string): Property name
+            type (string): Used for converting json type to XML type
+            basetype (string): Parent data type of property.
+        Returns:
+            result (string): XML Property
+        """
+        prop_name = val[0].upper() + val[1:]
+        if (type == 'object' or type == 'array'):
+            bt = self.parent_basetype or (basetype[0].upper() + basetype[1:])
+            return f'          <Property Name="{prop_name}" Type="{bt}.{baseid}{prop_name}"></Property>\n'
+        else:
+            edm_type = _TYPEMAP.get(type)
+            if edm_type is None:
+                raise ValueError("unsupported json type '%s' for property %s" % (type, val))
+            return f'          <Property Name="{prop_name}" Type="{edm_type}"></Property>\n'
+
     def append_to_xml(self, xml, arg):
         return xml + arg
 
     def validate_xml(self, xmlf):
-        entity_names=[]
+        """
+        Report EntityType names that are defined more than once
+        Args:
+            xmlf (string): Path to the generated XML schema
+        Returns:
+            result (list): Duplicate entity names, in order of appearance
+        """
+        seen = set()
+        dupes = []
+        for name in self.entity_names(xmlf):
+            if name in seen:
+                print("Duplicate: ", name)
+                dupes.append(name)
+            else:
+                seen.add(name)
+        return dupes
+
+    def entity_names(self, xmlf):
+        """
+        List the EntityType names of an XML schema, in document order
+        Args:
+            xmlf (string): Path to the generated XML schema
+        Returns:
+            result (list): EntityType names
+        """
+        if etree is not None:
+            try:
+                tree = etree.parse(xmlf)
+            except etree.XMLSyntaxError:
+                # fall back to the line scan so a malformed file is still checked
+                pass
+            else:
+                return [str(name) for name in tree.xpath('//*[local-name()="EntityType"]/@Name')]
+
+        names = []
         with open(xmlf, 'r') as f:
             for line in f:
-                if ("EntityType Name" in line):
-                    name = line.strip().split('=')[1]
-                    if name in entity_names:
-                        print("Duplicate: ", name)
-                    else:
-                        entity_names.append(name)
+                if 'EntityType Name' not in line:
+                    continue
+                m = _ENTITY_RE.search(line)
+                if m:
+                    names.append(m.group(1))
+        return names
             
 
 
@@ -393,6 +645,9 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
+    if args.verbose:
+        logging.basicConfig(level=logging.DEBUG, format='%(message)s')
+
     if args.subparser_name == 'json_master':
         print("Creating master json")
         # Master JSON Schema creation
@@ -406,9 +661,9 @@ if __name__ == "__main__":
 
         output = "master-schema.json"
         print("Output filename: ", output)
-        with open(output, 'w') as f:
-            print(json.dumps(master_schema, indent=1), file=f)
-            # json.dump(master_schema, f)
+        # orjson writes non-ASCII characters unescaped
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(_dumps(master_schema) + "\n")
 
 
     elif args.subparser_name == 'json_to_xml':
@@ -449,12 +704,21 @@ if __name__ == "__main__":
             exit(0)
 
         schema = xml_obj.get_schema_file(args.schema[0])
-        output = xml_obj.schema_parser(schema)
 
         out_file = "master-schema.xml"
         print("Output filename: ", out_file)
-        with open(out_file, 'w') as f:
-            print(output, file=f)
+        # Stream into a temporary file next to the output and only replace
+        # the output once the whole schema has been converted
+        tmp_file = out_file + ".tmp"
+        try:
+            with open(tmp_file, 'w') as f:
+                f.write(HEADER)
+                f.writelines(xml_obj.iter_schema(schema))
+                f.write(FOOTER + "\n")
+            os.replace(tmp_file, out_file)
+        except BaseException:
+            os.unlink(tmp_file)
+            raise
     
     else:
         exit(1)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+Regression checks for combining json schemas and for the
+json schema -> XML conversion
+
+The baseline XML files in tests/data were generated with the original
+script from final_out.json, using the CLI defaults (parent basetype
+Nvidia, start property sections).
+"""
+
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA = os.path.join(ROOT, 'tests', 'data')
+sys.path.insert(0, ROOT)
+
+import schemagen
+
+
+def entity_variants(xml):
+    """
+    Map each EntityType name to the set of distinct property sets it was emitted with
+    Args:
+        xml (string): XML schema
+    Returns:
+        result (dict): EntityType name -> set of frozensets of (Name, Type)
+    """
+    variants = {}
+    for element in ET.fromstring(xml).iter():
+        if element.tag.endswith('}EntityType'):
+            props = frozenset((p.get('Name'), p.get('Type')) for p in element if p.tag.endswith('}Property'))
+            variants.setdefault(element.get('Name'), set()).add(props)
+    return variants
+
+
+def entity_xml(xml):
+    """
+    List the EntityType elements of an XML schema, in document order
+    Args:
+        xml (string): XML schema
+    Returns:
+        result (list): Serialized EntityType elements
+    """
+    return [ET.tostring(e) for e in ET.fromstring(xml).iter() if e.tag.endswith('}EntityType')]
+
+
+class TestJsontoXml(unittest.TestCase):
+
+    def generate(self, required):
+        converter = schemagen.JsontoXml(parent_basetype='Nvidia', required=required)
+        schema = converter.get_schema_file(os.path.join(ROOT, 'final_out.json'))
+        return converter.schema_parser(schema)
+
+    def baseline(self, filename):
+        with open(os.path.join(DATA, filename), 'r') as f:
+            return f.read()
+
+    def check_against_baseline(self, required, filename):
+        xml = self.generate(required)
+        baseline = self.baseline(filename)
+        # Every variant of every entity is kept, nothing new is added
+        self.assertEqual(entity_variants(xml), entity_variants(baseline))
+        # Only exact repeats of an entity are dropped
+        entities = entity_xml(xml)
+        self.assertEqual(len(entities), len(set(entities)))
+        self.assertEqual(set(entities), set(entity_xml(baseline)))
+
+    def test_properties_match_baseline(self):
+        self.check_against_baseline(False, 'baseline-master-schema.xml')
+
+    def test_required_properties_match_baseline(self):
+        self.check_against_baseline(True, 'baseline-master-schema-required.xml')
+
+    def write_xml(self, xml):
+        fd, path = tempfile.mkstemp(suffix='.xml')
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, 'w') as f:
+            f.write(xml)
+        return path
+
+    def validate(self, xmlf):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return schemagen.JsontoXml().validate_xml(xmlf)
+
+    def test_validate_finds_duplicates(self):
+        xml = self.baseline('baseline-master-schema.xml')
+        names = [m.group(1) for m in schemagen._ENTITY_RE.finditer(xml)]
+        dupes = [name for i, name in enumerate(names) if name in names[:i]]
+        self.assertTrue(dupes)
+        self.assertEqual(self.validate(self.write_xml(xml)), dupes)
+
+    @unittest.skipIf(schemagen.etree is None, "lxml is not installed")
+    def test_validate_malformed_xml_falls_back_to_scan(self):
+        xml = self.baseline('baseline-master-schema.xml')
+        truncated = xml[:xml.rindex('<EntityType Name=')]
+        path = self.write_xml(truncated)
+        etree = schemagen.etree
+        try:
+            schemagen.etree = None
+            scanned = self.validate(path)
+        finally:
+            schemagen.etree = etree
+        self.assertTrue(scanned)
+        self.assertEqual(self.validate(path), scanned)
+
+    def test_empty_oneof_is_not_followed(self):
+        converter = schemagen.JsontoXml()
+        with self.assertRaises(ValueError):
+            converter.find_start_property({'required': ['sections'], 'oneOf': []})
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertIsNone(converter.schema_parser({'required': ['sections'], 'oneOf': []}))
+
+
+class TestSchemaGenerator(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def write(self, path, schema):
+        path = os.path.join(self.tmpdir.name, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(schema, f)
+
+    def generator(self, base_schema):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return schemagen.SchemaGenerator(self.tmpdir.name, base_schema)
+
+    def test_base_schema_prefers_rootpath(self):
+        self.write('base.json', {'which': 'root'})
+        self.write('zz/base.json', {'which': 'zz'})
+        self.assertEqual(self.generator('base.json').base_schema, {'which': 'root'})
+
+    def test_base_schema_found_by_filename(self):
+        self.write('aa/only.json', {'which': 'aa'})
+        self.assertEqual(self.generator('only.json').base_schema, {'which': 'aa'})
+
+    def test_ref_fragment_resolves_to_file(self):
+        self.write('base.json', {'properties': {
+            'a': {'$ref': './common/defs.json#/definitions/x'},
+            'b': {'$ref': 'common\\defs.json'},
+        }})
+        self.write('common/defs.json', {'$schema': 'x', 'type': 'string'})
+        generator = self.generator('base.json')
+        master = generator.replace_refs(generator.base_schema)
+        self.assertEqual(master, {'properties': {'a': {'type': 'string'}, 'b': {'type': 'string'}}})
+
+    def test_modify_schema_nested(self):
+        self.write('base.json', {})
+        schema = {'title': 'top', 'properties': {'a': {'title': 'nested'}, 'b': [{'title': 'item'}, 'leaf']}}
+        modified = self.generator('base.json').modify_schema(schema, 'title')
+        self.assertEqual(modified, {'title': 'Top', 'properties': {'a': {'title': 'Nested'}, 'b': [{'title': 'Item'}, 'leaf']}})
+
+    def test_modify_schema_shared_ref_once(self):
+        self.write('base.json', {'properties': {'a': {'$ref': 'defs.json'}, 'b': {'$ref': 'defs.json'}}})
+        self.write('defs.json', {'title': 'x'})
+        generator = self.generator('base.json')
+        master = generator.replace_refs(generator.base_schema)
+        generator.capitalize = lambda propname: propname + '!'
+        generator.modify_schema(master, 'title')
+        self.assertEqual(master['properties']['a'], {'title': 'x!'})
+        self.assertEqual(master['properties']['b'], {'title': 'x!'})
+
+
+if __name__ == '__main__':
+    unittest.main()